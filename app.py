@@ -1,19 +1,52 @@
 import os
+
+# Tesseract de un solo hilo: el paralelismo lo aporta el ProcessPoolExecutor
+# (varios procesos de un hilo rinden más que un único Tesseract con OpenMP).
+# Los procesos del pool heredan esta variable. Debe fijarse antes de importar
+# tesserocr (o cualquier módulo que cargue OpenMP), que la lee al cargarse.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import json
+import atexit
+import functools
+import hashlib
 import logging
+import re
+import string
+import cv2
 import fitz
+import numpy as np
 import requests
-import pdfplumber
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import camelot
 import pytesseract
 from pytesseract import Output
 from PIL import Image
-from pdf2image import convert_from_path
 from tabulate import tabulate
 import shutil
+import subprocess
+import uuid
+import zipfile
 from whoosh import index
-from whoosh.fields import Schema, TEXT, ID
+from whoosh.fields import Schema, TEXT, ID, NUMERIC
+from whoosh.analysis import RegexTokenizer, LowercaseFilter
+from whoosh.qparser import QueryParser
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson serializa JSON mucho más rápido; si no está instalado se usa la librería estándar
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# tesserocr usa Tesseract como biblioteca y mantiene el modelo cargado entre páginas;
+# si no está instalado se usa pytesseract, que lanza un proceso de tesseract por página
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 # Configuración de logging para registrar eventos y errores
 logging.basicConfig(level=logging.INFO,
@@ -23,20 +56,68 @@ logging.basicConfig(level=logging.INFO,
 # FUNCIONES AUXILIARES
 ###################################
 
+# Tamaño de los bloques en que se escribe a disco un PDF descargado (1 MiB)
+TAMANO_BLOQUE_DESCARGA = 1024 * 1024
+
+def _crear_sesion_http():
+    """
+    Crea una sesión HTTP compartida que reutiliza conexiones entre descargas y
+    reintenta ante errores transitorios del servidor.
+    """
+    reintentos = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                       raise_on_status=False)
+    adaptador = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=reintentos)
+    sesion = requests.Session()
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+_SESSION = _crear_sesion_http()
+
+def _ruta_temporal(ruta):
+    """
+    Devuelve un nombre de archivo temporal único junto a ruta, en la misma carpeta
+    para que os.replace sea atómico y sin que dos escrituras al mismo destino se pisen.
+    """
+    return f"{ruta}.{uuid.uuid4().hex}.part"
+
 def descargar_pdf(url, output_file="temp.pdf"):
     """
     Descarga un PDF desde una URL y lo guarda en output_file.
     """
     logging.info(f"Descargando PDF desde: {url}")
-    r = requests.get(url)
-    if r.status_code == 200:
-        with open(output_file, "wb") as f:
-            f.write(r.content)
-        logging.info(f"PDF descargado correctamente: {output_file}")
-        print(f"DEBUG: Archivo descargado en {output_file}")
-        return output_file
-    else:
-        raise ValueError(f"No se pudo descargar el PDF. Estado: {r.status_code}")
+    # Se descarga por bloques para no mantener el PDF completo en memoria, sobre un
+    # archivo temporal que solo reemplaza al destino cuando la descarga termina bien
+    temporal = _ruta_temporal(output_file)
+    try:
+        with _SESSION.get(url, stream=True, timeout=(5, 60)) as r:
+            if r.status_code != 200:
+                raise ValueError(f"No se pudo descargar el PDF. Estado: {r.status_code}")
+            with open(temporal, "wb") as f:
+                for chunk in r.iter_content(chunk_size=TAMANO_BLOQUE_DESCARGA):
+                    f.write(chunk)
+        os.replace(temporal, output_file)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    logging.info(f"PDF descargado correctamente: {output_file}")
+    print(f"DEBUG: Archivo descargado en {output_file}")
+    return output_file
+
+def descargar_pdfs(pares, max_workers=8):
+    """
+    Descarga varios PDFs en paralelo. pares es una lista de tuplas (url, output_file);
+    devuelve las rutas en el mismo orden. Los hilos comparten la sesión HTTP.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda par: descargar_pdf(*par), pares))
+
+# Tabla de consulta por byte: 1 para los caracteres ASCII alfanuméricos
+_ALNUM_LUT = np.zeros(256, dtype=np.uint8)
+_ALNUM_LUT[list((string.ascii_letters + string.digits).encode("ascii"))] = 1
+# Tabla para str.translate que elimina los 128 caracteres ASCII y deja solo el resto
+_SIN_ASCII = str.maketrans("", "", "".join(chr(i) for i in range(128)))
 
 def calcular_precision_aproximada(texto):
     """
@@ -45,49 +126,52 @@ def calcular_precision_aproximada(texto):
     t = texto.strip()
     if not t:
         return 0
-    letras_numeros = sum(c.isalnum() for c in t)
+    # En UTF-8 los bytes < 128 son exactamente los caracteres ASCII: se clasifican con la tabla
+    b = np.frombuffer(t.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+    letras_numeros = int(_ALNUM_LUT[b].sum(dtype=np.int64))
+    if not t.isascii():
+        # Solo los caracteres no ASCII (acentos, eñes...) pasan por str.isalnum
+        letras_numeros += sum(c.isalnum() for c in t.translate(_SIN_ASCII))
     return round(letras_numeros / len(t), 2)
 
+def _agrupar_palabras(top, left, width, threshold_vertical, threshold_horizontal):
+    """
+    Agrupa palabras en filas y celdas a partir de sus coordenadas (arreglos int32).
+    Devuelve el orden de lectura de las palabras, la fila de cada palabra en ese
+    orden y las posiciones donde empieza cada celda.
+    """
+    # Filas: se abre una nueva cuando el salto vertical respecto a la palabra anterior alcanza el umbral
+    orden = np.argsort(top, kind="stable")
+    fila_id = np.concatenate(([0], np.cumsum(np.diff(top[orden]) >= threshold_vertical))).astype(np.int32)
+    # Celdas: dentro de cada fila se ordena por "left" y se corta donde el hueco supera el umbral
+    por_fila = np.lexsort((left[orden], fila_id))
+    orden, fila_id = orden[por_fila], fila_id[por_fila]
+    left, width = left[orden], width[orden]
+    gap = left[1:] - (left[:-1] + width[:-1])
+    nueva_celda = np.concatenate(([True], (np.diff(fila_id) != 0) | (gap > threshold_horizontal)))
+    return orden, fila_id, np.flatnonzero(nueva_celda)
+
 def bounding_boxes_a_tabla(img, threshold_vertical=10, threshold_horizontal=60):
     """
     Aplica OCR a la imagen y organiza el resultado en una tabla utilizando bounding boxes.
     """
-    df = pytesseract.image_to_data(
-        img, output_type=Output.DATAFRAME, lang='spa')
-    df = df.dropna(subset=["text"])
-    df = df[df.conf != -1].reset_index(drop=True)
-    df = df.sort_values(by="top").reset_index(drop=True)
-    filas, fila_actual = [], []
-    last_top = None
-    for _, row in df.iterrows():
-        if last_top is None:
-            fila_actual.append(row)
-            last_top = row["top"]
-        else:
-            if abs(row["top"] - last_top) < threshold_vertical:
-                fila_actual.append(row)
-            else:
-                filas.append(fila_actual)
-                fila_actual = [row]
-            last_top = row["top"]
-    if fila_actual:
-        filas.append(fila_actual)
-    tabla_final = []
-    for fila in filas:
-        orden = sorted(fila, key=lambda x: x["left"])
-        celdas = []
-        current_col = [orden[0]["text"]]
-        last_right = orden[0]["left"] + orden[0]["width"]
-        for w in orden[1:]:
-            gap = w["left"] - last_right
-            if gap > threshold_horizontal:
-                celdas.append(" ".join(current_col))
-                current_col = [w["text"]]
-            else:
-                current_col.append(w["text"])
-            last_right = w["left"] + w["width"]
-        celdas.append(" ".join(current_col))
-        tabla_final.append(celdas)
+    datos = pytesseract.image_to_data(img, output_type=Output.DICT, lang='spa')
+    # Solo interesan las palabras: los niveles de bloque/línea tienen conf -1 y texto vacío
+    conf = np.asarray(datos.get("conf", []), dtype=np.int32)
+    text = np.asarray(datos.get("text", []), dtype=object)
+    keep = (conf != -1) & (text != "")
+    if not keep.any():
+        return tabulate([], headers=[], tablefmt="grid")
+    orden, fila_id, inicios = _agrupar_palabras(
+        np.asarray(datos["top"], dtype=np.int32)[keep],
+        np.asarray(datos["left"], dtype=np.int32)[keep],
+        np.asarray(datos["width"], dtype=np.int32)[keep],
+        threshold_vertical, threshold_horizontal)
+    text = text[keep][orden]
+    fines = np.append(inicios[1:], len(text))
+    tabla_final = [[] for _ in range(int(fila_id[-1]) + 1)]
+    for inicio, fin in zip(inicios, fines):
+        tabla_final[fila_id[inicio]].append(" ".join(text[inicio:fin]))
     max_cols = max(len(r) for r in tabla_final) if tabla_final else 0
     headers = [f"Col{i+1}" for i in range(max_cols)]
     ajustada = []
@@ -97,54 +181,133 @@ def bounding_boxes_a_tabla(img, threshold_vertical=10, threshold_horizontal=60):
         ajustada.append(row)
     return tabulate(ajustada, headers=headers, tablefmt="grid")
 
-def extraer_tablas_camelot(pdf_path, page_number):
+def tabla_ascii(filas):
+    """
+    Formatea una lista de filas como tabla ASCII con el mismo aspecto que
+    tabulate(..., tablefmt="grid"). Los saltos de línea dentro de una celda
+    se reemplazan por espacios.
+    """
+    celdas = [["" if c is None else str(c).replace("\n", " ") for c in fila] for fila in filas]
+    n_cols = max((len(fila) for fila in celdas), default=0)
+    if not n_cols:
+        return ""
+    for fila in celdas:
+        fila += [""] * (n_cols - len(fila))
+    anchos = [max(len(c) for c in columna) for columna in zip(*celdas)]
+    separador = "+" + "+".join("-" * (ancho + 2) for ancho in anchos) + "+"
+    lineas = [separador]
+    for fila in celdas:
+        lineas.append("| " + " | ".join(c.ljust(ancho) for c, ancho in zip(fila, anchos)) + " |")
+        lineas.append(separador)
+    return "\n".join(lineas)
+
+def tiene_lineas(py_page):
+    """
+    Indica si la página tiene líneas o rectángulos vectoriales, que es lo que
+    necesita el modo "lattice" de Camelot para detectar tablas.
+    """
+    return any(item[0] in ("l", "re")
+               for dibujo in py_page.get_drawings() for item in dibujo["items"])
+
+def extraer_todas_tablas_camelot(pdf_path, paginas="1-end"):
     """
-    Extrae tablas de una página del PDF usando Camelot.
+    Extrae con Camelot las tablas de las páginas indicadas en una sola pasada.
+    paginas puede ser una lista de números de página o un rango en formato Camelot.
+    Devuelve un diccionario {número de página: [(tabla ASCII, filas)]}.
     """
+    tablas_por_pagina = {}
+    if not paginas:
+        return tablas_por_pagina
+    if not isinstance(paginas, str):
+        paginas = ",".join(str(n) for n in paginas)
     try:
-        tables = camelot.read_pdf(
-            pdf_path, pages=str(page_number), flavor="lattice")
-        ascii_tables = []
-        for t in tables:
-            df = t.df
-            ascii_table = tabulate(df.values.tolist(), tablefmt="grid")
-            ascii_tables.append(ascii_table)
-        return ascii_tables
+        tables = camelot.read_pdf(pdf_path, pages=paginas, flavor="lattice")
     except Exception as e:
-        logging.warning(f"[Camelot] Error en la página {page_number}: {e}")
-        return []
-
-def extraer_tablas_pdfplumber(plumber_page):
+        logging.warning(f"[Camelot] Error al procesar {pdf_path}: {e}")
+        return tablas_por_pagina
+    for t in tables:
+        filas = t.df.values.tolist()
+        tablas_por_pagina.setdefault(int(t.page), []).append((tabla_ascii(filas), filas))
+    return tablas_por_pagina
+
+def extraer_tablas_pymupdf(py_page):
     """
-    Extrae tablas de una página del PDF usando pdfplumber.
+    Extrae tablas de una página del PDF usando PyMuPDF.
+    Devuelve una lista de pares (tabla ASCII, filas).
     """
-    ascii_tables = []
-    tbls = plumber_page.extract_tables()
-    if tbls:
-        for tbl in tbls:
-            ascii_tables.append(tabulate(tbl, tablefmt="grid"))
-    return ascii_tables
+    tablas = []
+    for tabla in py_page.find_tables().tables:
+        filas = tabla.extract()
+        if filas:
+            tablas.append((tabla_ascii(filas), filas))
+    return tablas
+
+def escribir_json(ruta, data):
+    """
+    Guarda data como JSON indentado y en UTF-8 sin escapar, serializado con orjson
+    (o con la librería estándar si orjson no está disponible).
+    """
+    if orjson is not None:
+        contenido = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        contenido = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    escribir_atomico(ruta, contenido)
 
-def guardar_tablas_separadas(tablas, carpeta_salida, nombre_pag):
+def escribir_atomico(ruta, contenido):
     """
-    Guarda las tablas extraídas de una página en un archivo JSON separado.
+    Escribe bytes en un archivo temporal y lo mueve a la ruta final, de modo que
+    nunca quede un archivo a medio escribir.
     """
+    temporal = _ruta_temporal(ruta)
+    try:
+        with open(temporal, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+# Formatos admitidos para los archivos de tablas por página
+FORMATOS_TABLAS = ("json", "msgpack", "parquet")
+
+def guardar_tablas_separadas(tablas, carpeta_salida, nombre_pag, formato="json"):
+    """
+    Guarda las tablas extraídas de una página, cada una como lista de filas de
+    celdas, en un archivo separado. Además de JSON admite "msgpack" y "parquet",
+    más compactos y rápidos de leer, que requieren instalar msgpack o pyarrow.
+    """
+    if formato not in FORMATOS_TABLAS:
+        raise ValueError(f"Formato de tablas no soportado: {formato}")
     if not tablas:
         return None
     data_tablas = []
-    for idx, tab in enumerate(tablas, start=1):
-        data_tablas.append({"tabla_num": idx, "contenido": tab.split("\n")})
-    path_tablas = os.path.join(carpeta_salida, f"tablas_pag_{nombre_pag}.json")
-    with open(path_tablas, "w", encoding="utf-8") as f:
-        json.dump(data_tablas, f, indent=2, ensure_ascii=False)
+    for idx, filas in enumerate(tablas, start=1):
+        data_tablas.append({"tabla_num": idx, "contenido": filas})
+    path_tablas = os.path.join(carpeta_salida, f"tablas_pag_{nombre_pag}.{formato}")
+    if formato == "json":
+        escribir_json(path_tablas, data_tablas)
+    elif formato == "msgpack":
+        import msgpack
+        escribir_atomico(path_tablas, msgpack.packb(data_tablas))
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        buffer = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pylist(data_tablas), buffer, compression="zstd")
+        escribir_atomico(path_tablas, buffer.getvalue())
     return path_tablas
 
 def extraer_formularios(doc):
     """
     Extrae campos de formulario (widgets) de cada página del PDF.
     """
+    # Sin AcroForm no hay widgets que recorrer
+    if not getattr(doc, "is_form_pdf", False):
+        return []
     formularios = []
-    for i, page in enumerate(doc):
+    for i in range(doc.page_count):
+        page = doc[i]
         widgets = page.widgets()
         if widgets:
             for w in widgets:
@@ -155,50 +318,330 @@ def extraer_formularios(doc):
                 })
     return formularios
 
-def crear_indice_y_indexar(carpeta_indice, texto_global):
+# Esquema de los índices nuevos, construido una sola vez al importar.
+# Solo se tokeniza y pasa a minúsculas: el StandardAnalyzer por defecto añade un filtro
+# de palabras vacías en inglés que no aporta nada en documentos en español.
+_ESQUEMA_INDICE = Schema(id=ID(stored=True), pagina=NUMERIC(stored=True),
+                         content=TEXT(analyzer=RegexTokenizer() | LowercaseFilter(), stored=False))
+
+def crear_indice_y_indexar(carpeta_indice, textos, procs=1):
     """
-    Crea un índice con Whoosh e indexa el contenido global extraído.
+    Crea un índice con Whoosh e indexa el contenido extraído.
+    Si textos es un iterable con el texto de cada página, cada página se indexa
+    como un documento propio para que las búsquedas devuelvan la página encontrada.
+    Con procs > 1 el indexado se reparte entre procesos, cada uno con su segmento.
     """
+    # Un buscador abierto sobre el índice anterior quedaría obsoleto
+    _cerrar_buscador(carpeta_indice)
     if not os.path.exists(carpeta_indice):
         os.mkdir(carpeta_indice)
-    schema = Schema(id=ID(stored=True), content=TEXT(stored=False))
-    ix = index.create_in(carpeta_indice, schema)
-    writer = ix.writer()
-    writer.add_document(id="documento_pdf", content=texto_global)
-    writer.commit()
+    ix = index.create_in(carpeta_indice, _ESQUEMA_INDICE)
+    # Búfer en memoria amplio para evitar fusiones intermedias de segmentos
+    writer = ix.writer(procs=procs, limitmb=256, multisegment=procs > 1)
+    if isinstance(textos, str):
+        writer.add_document(id="documento_pdf", content=textos)
+    else:
+        for num, texto in enumerate(textos, start=1):
+            writer.add_document(id=f"pagina_{num}", pagina=num, content=texto)
+    writer.commit(optimize=False)
+    _buscar_cacheado.cache_clear()
+
+# Índices, buscadores y parsers de consultas de Whoosh abiertos, reutilizados entre
+# consultas: {carpeta: (índice, buscador, versión del índice, parser)}
+_BUSCADORES = {}
+
+def _version_indice(ix):
+    """
+    Identifica el estado del índice en disco con la generación de su TOC y la fecha
+    de modificación de ese archivo, que cambia también cuando otro proceso
+    reconstruye el índice desde cero y la generación vuelve a empezar.
+    """
+    generacion = ix.latest_generation()
+    return generacion, ix.storage.file_modified(f"_{ix.indexname}_{generacion}.toc")
+
+def _obtener_buscador(carpeta_indice):
+    """
+    Devuelve el índice, un buscador abierto, la versión del índice y un parser de
+    consultas para la carpeta, creándolos solo la primera vez o cuando el índice en
+    disco ha cambiado. El parser usa el esquema del índice abierto, de modo que las
+    consultas se analizan igual que se indexó el contenido aunque el índice sea de
+    una versión anterior con otro analizador.
+    """
+    clave = os.path.abspath(carpeta_indice)
+    entrada = _BUSCADORES.get(clave)
+    if entrada is not None and _version_indice(entrada[0]) != entrada[2]:
+        entrada[1].close()
+        entrada = None
+    if entrada is None:
+        ix = index.open_dir(carpeta_indice)
+        # La versión se lee antes de abrir el buscador: si cambia entre medias,
+        # la siguiente consulta vuelve a abrirlo
+        version = _version_indice(ix)
+        entrada = (ix, ix.searcher(), version, QueryParser("content", ix.schema))
+        _BUSCADORES[clave] = entrada
+    return entrada
+
+def _cerrar_buscador(carpeta_indice):
+    """
+    Cierra y descarta el buscador en caché de la carpeta, si existe.
+    """
+    entrada = _BUSCADORES.pop(os.path.abspath(carpeta_indice), None)
+    if entrada:
+        entrada[1].close()
 
-def buscar_en_indice(carpeta_indice, consulta):
+@atexit.register
+def _cerrar_buscadores():
+    """
+    Cierra todos los buscadores abiertos al terminar el programa.
+    """
+    for carpeta_indice in list(_BUSCADORES):
+        _cerrar_buscador(carpeta_indice)
+
+def buscar_en_indice(carpeta_indice, consulta, limit=10):
     """
     Realiza una búsqueda en el índice creado con Whoosh.
+    Los resultados de consultas repetidas se sirven desde una caché, indexada por
+    la versión del índice para no devolver resultados de un índice ya reconstruido.
+    """
+    carpeta_indice = os.path.abspath(carpeta_indice)
+    _, _, version, _ = _obtener_buscador(carpeta_indice)
+    resultados = _buscar_cacheado(carpeta_indice, version, consulta, limit)
+    return [dict(r) for r in resultados]
+
+@functools.lru_cache(maxsize=256)
+def _buscar_cacheado(carpeta_indice, version, consulta, limit):
+    """
+    Ejecuta la consulta sobre el índice. version solo forma parte de la clave de la caché.
     """
-    ix = index.open_dir(carpeta_indice)
-    with ix.searcher() as searcher:
-        from whoosh.qparser import QueryParser
-        parser = QueryParser("content", ix.schema)
-        query = parser.parse(consulta)
-        results = searcher.search(query, limit=10)
-        return [r.fields() for r in results]
+    _, searcher, _, parser = _obtener_buscador(carpeta_indice)
+    query = parser.parse(consulta)
+    results = searcher.search(query, limit=limit)
+    return tuple(r.fields() for r in results)
 
 ######################################
 # PROCESAMIENTO DEL PDF
 ######################################
 
 # Aseguramos las importaciones necesarias para el OCR optimizado
-from pdf2image import convert_from_path
 import pytesseract
 from PIL import Image
 from concurrent.futures import ProcessPoolExecutor
 
-# Configuración personalizada para Tesseract
-CUSTOM_CONFIG = r'--oem 1 --psm 6'
+# Configuración personalizada para Tesseract: se desactivan la inversión de imagen
+# y los diccionarios del motor clásico, innecesarios en documentos escaneados limpios
+VARIABLES_TESSERACT = {"tessedit_do_invert": "0", "load_system_dawg": "0", "load_freq_dawg": "0"}
+CUSTOM_CONFIG = '--oem 1 --psm 6 ' + ' '.join(f'-c {k}={v}' for k, v in VARIABLES_TESSERACT.items())
+
+# Resolución a la que se rasterizan las páginas escaneadas
+DPI_OCR = 250
+
+# Caché en disco de los textos OCR, indexada por el contenido del PDF. La carpeta se
+# puede cambiar con OCR_CACHE_DIR y su tamaño máximo (en MB) con OCR_CACHE_MAX_MB
+CARPETA_CACHE_OCR = os.environ.get("OCR_CACHE_DIR", os.path.expanduser("~/.cache/ocr-docker"))
+TAMANO_MAXIMO_CACHE_OCR = int(os.environ.get("OCR_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+# Estado de cada proceso del pool de OCR: documento abierto, idioma y, si tesserocr
+# está disponible, la instancia de Tesseract con el modelo ya cargado
+_doc_ocr = None
+_idioma_ocr = None
+_api_ocr = None
+
+def _inicializar_worker_ocr(pdf_path, idioma):
+    """
+    Abre el PDF una sola vez por proceso del pool para rasterizar sus páginas y,
+    con tesserocr, inicializa Tesseract una única vez para todas las páginas del proceso.
+    """
+    global _doc_ocr, _idioma_ocr, _api_ocr
+    _doc_ocr = fitz.open(pdf_path)
+    _idioma_ocr = idioma
+    if tesserocr is not None:
+        _api_ocr = tesserocr.PyTessBaseAPI(lang=idioma, psm=tesserocr.PSM.SINGLE_BLOCK,
+                                           oem=tesserocr.OEM.LSTM_ONLY,
+                                           variables=VARIABLES_TESSERACT)
+
+def pagina_binarizada(py_page, dpi=DPI_OCR):
+    """
+    Rasteriza una página una sola vez, en escala de grises, y la devuelve binarizada
+    como arreglo uint8 de (alto, ancho). Es el único punto donde se renderizan páginas para OCR.
+    """
+    pix = py_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    # Vista directa sobre el búfer del pixmap, sin copiarlo: solo es válida mientras
+    # exista pix, y preprocesar_para_ocr devuelve un arreglo nuevo
+    gris = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width)
+    return preprocesar_para_ocr(gris)
+
+# Versión del preprocesado de preprocesar_para_ocr: forma parte de la clave de la caché
+# de OCR, así que debe incrementarse con cualquier cambio que altere la imagen binarizada
+VERSION_PREPROCESADO = 1
 
-def procesar_pdf(pdf_path, carpeta_salida, idioma="spa"):
+def preprocesar_para_ocr(gris):
+    """
+    Binariza una imagen en escala de grises con umbral adaptativo, de modo que
+    Tesseract reciba texto limpio aunque el escaneo tenga iluminación irregular.
+    """
+    return cv2.adaptiveThreshold(gris, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, 31, 10)
+
+def _ocr_pagina(page_num):
+    """
+    Rasteriza una página con PyMuPDF, la binariza y le aplica OCR.
+    Se ejecuta dentro del pool de procesos.
+    """
+    img = Image.fromarray(pagina_binarizada(_doc_ocr[page_num - 1]))
+    if _api_ocr is not None:
+        _api_ocr.SetImage(img)
+        return page_num, _api_ocr.GetUTF8Text()
+    return page_num, pytesseract.image_to_string(img, lang=_idioma_ocr, config=CUSTOM_CONFIG)
+
+@functools.lru_cache(maxsize=None)
+def _version_motor_ocr(idioma):
+    """
+    Identifica el motor de OCR instalado: versión de Tesseract y tamaño y fecha de los
+    traineddata del idioma. Así, actualizar la imagen no reutiliza textos del motor anterior.
+    """
+    try:
+        if tesserocr is not None:
+            version = tesserocr.tesseract_version()
+            tessdata = tesserocr.get_languages()[0]
+        else:
+            version = str(pytesseract.get_tesseract_version())
+            salida = subprocess.run([pytesseract.pytesseract.tesseract_cmd, "--list-langs"],
+                                    capture_output=True, text=True).stdout
+            # Primera línea: List of available languages in "/ruta/tessdata/" (N):
+            coincidencia = re.search(r'"([^"]+)"', salida)
+            tessdata = coincidencia.group(1) if coincidencia else None
+    except OSError as e:
+        logging.warning(f"[OCR] No se pudo obtener la versión de Tesseract: {e}")
+        return "desconocida"
+    modelos = []
+    for lang in idioma.split("+"):
+        ruta = os.path.join(tessdata, f"{lang}.traineddata") if tessdata else None
+        if ruta and os.path.isfile(ruta):
+            info = os.stat(ruta)
+            modelos.append(f"{lang}:{info.st_size}:{info.st_mtime_ns}")
+    return f"{version}|{','.join(modelos)}"
+
+def _carpeta_cache_ocr(pdf_path, idioma):
+    """
+    Devuelve la carpeta de caché de OCR del PDF: una subcarpeta por huella SHA-1 del
+    contenido y otra por configuración de OCR, para no reutilizar textos obtenidos
+    con otro idioma, resolución, preprocesado, motor o versión de Tesseract.
+    """
+    with open(pdf_path, "rb") as f:
+        huella = hashlib.file_digest(f, "sha1").hexdigest()[:16]
+    motor = "tesserocr" if tesserocr is not None else "pytesseract"
+    ajustes = (f"{idioma}|{DPI_OCR}|{CUSTOM_CONFIG}|{motor}|{_version_motor_ocr(idioma)}"
+               f"|preprocesado_{VERSION_PREPROCESADO}")
+    clave_ajustes = hashlib.sha1(ajustes.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(CARPETA_CACHE_OCR, huella, clave_ajustes)
+
+def _tamano_carpeta(carpeta):
+    """
+    Suma el tamaño de los archivos de una carpeta y sus subcarpetas, ignorando los
+    que desaparezcan mientras se recorre.
+    """
+    total = 0
+    for raiz, _, archivos in os.walk(carpeta):
+        for nombre in archivos:
+            try:
+                total += os.path.getsize(os.path.join(raiz, nombre))
+            except OSError:
+                pass
+    return total
+
+def _recortar_cache_ocr(conservar):
+    """
+    Mantiene la caché de OCR por debajo de TAMANO_MAXIMO_CACHE_OCR borrando primero
+    los PDFs usados hace más tiempo. Nunca borra la carpeta conservar (el PDF actual).
+    """
+    try:
+        carpetas = [e.path for e in os.scandir(CARPETA_CACHE_OCR) if e.is_dir()]
+    except OSError:
+        return
+    tamanos = {c: _tamano_carpeta(c) for c in carpetas}
+    total = sum(tamanos.values())
+    for carpeta in sorted(carpetas, key=os.path.getmtime):
+        if total <= TAMANO_MAXIMO_CACHE_OCR:
+            break
+        if carpeta != conservar:
+            shutil.rmtree(carpeta, ignore_errors=True)
+            total -= tamanos[carpeta]
+
+def _guardar_texto_cache(ruta, texto):
+    """
+    Guarda el texto OCR de una página en la caché. Un fallo de escritura no
+    interrumpe el proceso, solo impide reutilizar el resultado.
+    """
+    try:
+        escribir_atomico(ruta, texto.encode("utf-8"))
+    except OSError as e:
+        logging.warning(f"[OCR] No se pudo guardar en caché {ruta}: {e}")
+
+def ocr_paginas_en_paralelo(pdf_path, paginas, idioma="spa", mientras_tanto=None):
+    """
+    Aplica OCR a las páginas indicadas repartiéndolas entre procesos.
+    Las páginas ya procesadas de un PDF idéntico se leen de la caché en disco.
+    Si se indica mientras_tanto, se invoca en el hilo principal una vez enviadas
+    las páginas al pool, para aprovechar el tiempo que dura el OCR.
+    Devuelve un diccionario {número de página: texto}.
+    """
+    if not paginas:
+        if mientras_tanto is not None:
+            mientras_tanto()
+        return {}
+    carpeta_cache = _carpeta_cache_ocr(pdf_path, idioma)
+    textos = {}
+    for page_num in paginas:
+        ruta = os.path.join(carpeta_cache, f"pagina_{page_num}.txt")
+        if os.path.isfile(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                textos[page_num] = f.read()
+    pendientes = [n for n in paginas if n not in textos]
+    carpeta_pdf = os.path.dirname(carpeta_cache)
+    os.makedirs(carpeta_cache, exist_ok=True)
+    # La fecha de la carpeta del PDF marca su último uso, para recortar la caché
+    os.utime(carpeta_pdf)
+    if pendientes:
+        # No tiene sentido lanzar más procesos (cada uno abre el PDF) que páginas a procesar
+        max_workers = min(os.cpu_count() or 1, len(pendientes))
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_inicializar_worker_ocr,
+                                 initargs=(pdf_path, idioma)) as executor:
+            # map envía todas las páginas al pool de inmediato; los resultados se recogen después
+            resultados = executor.map(_ocr_pagina, pendientes)
+            if mientras_tanto is not None:
+                mientras_tanto()
+            for page_num, texto in resultados:
+                textos[page_num] = texto
+                _guardar_texto_cache(os.path.join(carpeta_cache, f"pagina_{page_num}.txt"), texto)
+        _recortar_cache_ocr(carpeta_pdf)
+    else:
+        logging.info(f"[OCR] {len(paginas)} páginas recuperadas de la caché")
+        if mientras_tanto is not None:
+            mientras_tanto()
+    return dict(sorted(textos.items()))
+
+def _iterar_bloques_txt(info_paginas):
+    """
+    Genera, separados por una línea en blanco, los bloques de texto y tablas
+    de cada página para escribirlos directamente en resultado.txt.
+    """
+    separador = ""
+    for p in info_paginas:
+        yield f"{separador}[Página {p['pagina']}]\n{p['texto']}"
+        separador = "\n\n"
+        for idx, tabla in enumerate(p.get("tablas") or [], start=1):
+            yield f"{separador}[Tabla {idx} - Página {p['pagina']}]\n{tabla}"
+
+def procesar_pdf(pdf_path, carpeta_salida, idioma="spa", formato_tablas="json"):
+    # Se valida antes del OCR, y aunque el documento no tenga tablas
+    if formato_tablas not in FORMATOS_TABLAS:
+        raise ValueError(f"Formato de tablas no soportado: {formato_tablas}")
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"No se encontró: {pdf_path}")
     os.makedirs(carpeta_salida, exist_ok=True)
 
     doc = fitz.open(pdf_path)
-    plumber_pdf = pdfplumber.open(pdf_path)
     npages = doc.page_count
     md = doc.metadata or {}
 
@@ -212,53 +655,69 @@ def procesar_pdf(pdf_path, carpeta_salida, idioma="spa"):
     formularios_detectados = extraer_formularios(doc)
 
     pags_ocr, pags_texto = 0, 0
+    paginas = []
+    paginas_texto = []
+    paginas_camelot = []
+    paginas_ocr = []
     info_paginas = []
-    texto_global_completo = []  # Para indexar luego
 
     for i in range(npages):
         page_num = i + 1
         py_page = doc[i]
-        txt_raw = py_page.get_text().strip()
-        plumber_page = plumber_pdf.pages[i]
+        txt_raw = py_page.get_text()
         contenido = ""
         ocr_flag = False
-        tablas_pagina = []
 
-        if txt_raw:
+        # Se comprueba si hay texto sin copiarlo; solo se recorta el que se guarda
+        if txt_raw and not txt_raw.isspace():
             pags_texto += 1
-            contenido = txt_raw
-            camelot_tables = extraer_tablas_camelot(pdf_path, page_num)
-            if camelot_tables:
-                tablas_pagina.extend(camelot_tables)
-            else:
-                plumber_tables = extraer_tablas_pdfplumber(plumber_page)
-                if plumber_tables:
-                    tablas_pagina.extend(plumber_tables)
+            contenido = txt_raw.strip()
+            paginas_texto.append(page_num)
+            # Sin líneas dibujadas Camelot "lattice" no encuentra tablas: se evita invocarlo
+            if tiene_lineas(py_page):
+                paginas_camelot.append(page_num)
         else:
-            # Optimización: extraer solo la imagen de la página actual con dpi reducido
-            images = convert_from_path(pdf_path, first_page=page_num, last_page=page_num, dpi=250)
-            if images:
-                contenido = pytesseract.image_to_string(images[0], config=CUSTOM_CONFIG)
-            else:
-                contenido = ""
+            # El OCR se difiere para repartir las páginas escaneadas entre procesos
+            paginas_ocr.append(page_num)
             ocr_flag = True
             pags_ocr += 1
 
+        paginas.append((page_num, contenido, ocr_flag))
+
+    # Camelot (una sola llamada para las páginas con líneas) corre en el hilo principal mientras
+    # el pool de procesos hace el OCR. No se usa un hilo aparte: hacer fork del proceso con otro
+    # hilo activo puede dejar bloqueos tomados en los procesos hijos.
+    tablas_por_pagina = {}
+    textos_ocr = ocr_paginas_en_paralelo(
+        pdf_path, paginas_ocr, idioma,
+        mientras_tanto=lambda: tablas_por_pagina.update(
+            extraer_todas_tablas_camelot(pdf_path, paginas_camelot)))
+    for page_num in paginas_texto:
+        if page_num not in tablas_por_pagina:
+            pymupdf_tables = extraer_tablas_pymupdf(doc[page_num - 1])
+            if pymupdf_tables:
+                tablas_por_pagina[page_num] = pymupdf_tables
+    doc.close()
+
+    for page_num, contenido, ocr_flag in paginas:
+        if ocr_flag:
+            contenido = textos_ocr.get(page_num, "")
+            tablas_pagina = []
+        else:
+            tablas_pagina = tablas_por_pagina.get(page_num, [])
         prec = calcular_precision_aproximada(contenido)
         info_paginas.append({
             "pagina": page_num,
             "texto": contenido,
             "ocr": ocr_flag,
             "precision_aproximada": prec,
-            "tablas": tablas_pagina if tablas_pagina else []
+            "tablas": [ascii_table for ascii_table, _ in tablas_pagina]
         })
-        texto_global_completo.append(contenido)
 
+        # Los archivos por página guardan las filas tal como se extrajeron, no la tabla ASCII
         if tablas_pagina:
-            guardar_tablas_separadas(tablas_pagina, carpeta_salida, str(page_num))
-
-    doc.close()
-    plumber_pdf.close()
+            guardar_tablas_separadas([filas for _, filas in tablas_pagina],
+                                     carpeta_salida, str(page_num), formato_tablas)
 
     total = pags_ocr + pags_texto
     if total == 0:
@@ -282,19 +741,15 @@ def procesar_pdf(pdf_path, carpeta_salida, idioma="spa"):
     }
     json_path = os.path.join(carpeta_salida, "resultado.json")
     texto_path = os.path.join(carpeta_salida, "resultado.txt")
+    escribir_json(json_path, data_final)
     with open(texto_path, "w", encoding="utf-8") as ft:
-        lineas_txt = []
-        for p in info_paginas:
-            lineas_txt.append(f"[Página {p['pagina']}]\n{p['texto']}")
-            if p.get("tablas"):
-                for idx, tabla in enumerate(p["tablas"], start=1):
-                    lineas_txt.append(f"[Tabla {idx} - Página {p['pagina']}]\n{tabla}")
-        ft.write("\n\n".join(lineas_txt))
+        ft.writelines(_iterar_bloques_txt(info_paginas))
 
     # Crear índice de búsqueda
     indice_dir = os.path.join(carpeta_salida, "indice_whoosh")
-    todo_el_texto = "\n".join(texto_global_completo)
-    crear_indice_y_indexar(indice_dir, todo_el_texto)
+    # Solo compensa lanzar procesos de indexado en documentos grandes (uno cada 100 páginas)
+    procs_indice = max(1, min((os.cpu_count() or 1) // 2, npages // 100))
+    crear_indice_y_indexar(indice_dir, (p["texto"] for p in info_paginas), procs=procs_indice)
 
     logging.info("Proceso de extracción completado.")
     return json_path, texto_path
@@ -303,8 +758,6 @@ def procesar_pdf(pdf_path, carpeta_salida, idioma="spa"):
 # MENÚ Y EJECUCIÓN
 ######################################
 
-import subprocess
-
 def obtener_ruta_valida():
     """
     Permite al usuario seleccionar un archivo PDF desde /host/Desktop.
@@ -412,8 +865,9 @@ def generar_resultados(pdf_path, carpeta_salida):
     json_path, txt_path = procesar_pdf(pdf_path, carpeta_salida)
     pdf_output = os.path.join(carpeta_salida, "original.pdf")
     shutil.copy(pdf_path, pdf_output)
-    import subprocess
-    subprocess.run(["zip", "-j", "resultado.zip", json_path, txt_path, pdf_output], check=True)
+    with zipfile.ZipFile("resultado.zip", "w", zipfile.ZIP_DEFLATED, compresslevel=6) as z:
+        for ruta in (json_path, txt_path, pdf_output):
+            z.write(ruta, arcname=os.path.basename(ruta))
     
     # Cambiar la ruta de destino al directorio Downloads
     destino = os.path.expanduser("~/Downloads/resultado.zip")
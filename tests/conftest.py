@@ -1,4 +1,42 @@
 import os
 import sys
 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
\ No newline at end of file
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app
+
+SAMPLE_TEXT = "Este es un documento de prueba. Contiene información sobre OCR."
+
+@pytest.fixture(scope="module")
+def whoosh_index(tmp_path_factory):
+    """
+    Índice Whoosh con SAMPLE_TEXT, creado una sola vez por módulo de pruebas.
+    """
+    carpeta_indice = tmp_path_factory.mktemp("indice")
+    app.crear_indice_y_indexar(str(carpeta_indice), SAMPLE_TEXT)
+    return str(carpeta_indice)
+
+class FakeResponse:
+    """
+    Respuesta HTTP simulada para las pruebas de descarga. Si se indica error,
+    se lanza después de entregar el contenido, como una conexión cortada.
+    """
+    def __init__(self, content=b"", status_code=200, error=None):
+        self.content = content
+        self.status_code = status_code
+        self.error = error
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+        if self.error:
+            raise self.error
+
+@pytest.fixture
+def fake_response():
+    return FakeResponse
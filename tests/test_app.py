@@ -2,8 +2,14 @@ import os
 import json
 import pytest
 import tempfile
+import zipfile
 from pathlib import Path
 
+import fitz
+import numpy as np
+from whoosh.analysis import RegexTokenizer
+from whoosh.fields import Schema, ID, NUMERIC, TEXT
+
 import app
 
 # Pruebas para calcular_precision_aproximada
@@ -18,38 +24,133 @@ def test_calcular_precision_aproximada_normal():
     # En "a!b@c#", solo se consideran a, b, c; precisión = 3/6 = 0.5
     assert app.calcular_precision_aproximada("a!b@c#") == 0.5
 
+def test_calcular_precision_aproximada_no_ascii():
+    # Las letras acentuadas cuentan como alfanuméricas: "ñá" sobre "ñá!?" = 0.5
+    assert app.calcular_precision_aproximada("ñá!?") == 0.5
+
 # Pruebas para descargar_pdf usando monkeypatch para simular la respuesta HTTP
 
-def test_descargar_pdf_success(tmp_path, monkeypatch):
-    class FakeResponse:
-        def __init__(self, content, status_code):
-            self.content = content
-            self.status_code = status_code
-    def fake_get(url):
-        return FakeResponse(b"fake pdf content", 200)
-    monkeypatch.setattr(app.requests, "get", fake_get)
+def test_descargar_pdf_success(tmp_path, monkeypatch, fake_response):
+    def fake_get(url, **kwargs):
+        assert kwargs.get("stream") is True
+        return fake_response(b"fake pdf content", 200)
+    monkeypatch.setattr(app._SESSION, "get", fake_get)
     output_file = str(tmp_path / "temp.pdf")
     result = app.descargar_pdf("http://example.com/fake.pdf", output_file)
     assert os.path.exists(output_file)
-    with open(output_file, "rb") as f:
-        content = f.read()
-    assert content == b"fake pdf content"
-
-def test_descargar_pdf_failure(monkeypatch):
-    class FakeResponse:
-        def __init__(self, status_code):
-            self.status_code = status_code
-            self.content = b""
-    def fake_get(url):
-        return FakeResponse(404)
-    monkeypatch.setattr(app.requests, "get", fake_get)
+    assert Path(output_file).read_bytes() == b"fake pdf content"
+
+def test_descargar_pdf_failure(monkeypatch, fake_response):
+    def fake_get(url, **kwargs):
+        return fake_response(status_code=404)
+    monkeypatch.setattr(app._SESSION, "get", fake_get)
     with pytest.raises(ValueError):
         app.descargar_pdf("http://example.com/fake.pdf")
 
+def test_descargar_pdf_interrumpida(tmp_path, monkeypatch, fake_response):
+    respuesta = fake_response(b"parte del pdf", error=ConnectionError("conexión cortada"))
+    monkeypatch.setattr(app._SESSION, "get", lambda url, **kwargs: respuesta)
+    output_file = tmp_path / "temp.pdf"
+    output_file.write_bytes(b"pdf anterior")
+    with pytest.raises(ConnectionError):
+        app.descargar_pdf("http://example.com/fake.pdf", str(output_file))
+    # El archivo previo queda intacto y no se deja el temporal
+    assert output_file.read_bytes() == b"pdf anterior"
+    assert list(tmp_path.iterdir()) == [output_file]
+
+def test_descargar_pdfs_paralelo(tmp_path, monkeypatch, fake_response):
+    def fake_get(url, **kwargs):
+        return fake_response(url.encode())
+    monkeypatch.setattr(app._SESSION, "get", fake_get)
+    pares = [(f"http://example.com/{i}.pdf", str(tmp_path / f"{i}.pdf")) for i in range(5)]
+    rutas = app.descargar_pdfs(pares, max_workers=3)
+    assert rutas == [salida for _, salida in pares]
+    for url, salida in pares:
+        assert Path(salida).read_bytes() == url.encode()
+
+# Prueba para tabla_ascii: mismo formato que tabulate "grid"
+
+def test_tabla_ascii_formato_grid():
+    from tabulate import tabulate
+    filas = [["Ítem", "Monto"], ["Hormigón", "1200"], ["Acero", None]]
+    esperado = tabulate([["Ítem", "Monto"], ["Hormigón", "1200"], ["Acero", ""]],
+                        tablefmt="grid", disable_numparse=True)
+    assert app.tabla_ascii(filas) == esperado
+    assert app.tabla_ascii([]) == ""
+
+# Prueba para extraer_tablas_pymupdf con una tabla dibujada
+
+def test_extraer_tablas_pymupdf():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.draw_rect(fitz.Rect(72, 100, 300, 200))
+    page.draw_line((72, 150), (300, 150))
+    page.draw_line((186, 100), (186, 200))
+    for punto, texto in [((80, 130), "a"), ((200, 130), "b"), ((80, 180), "c"), ((200, 180), "d")]:
+        page.insert_text(punto, texto)
+    tablas = app.extraer_tablas_pymupdf(page)
+    assert tablas == [(app.tabla_ascii([["a", "b"], ["c", "d"]]), [["a", "b"], ["c", "d"]])]
+
+# Pruebas para tiene_lineas y extraer_todas_tablas_camelot
+
+def test_tiene_lineas():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Solo texto")
+    assert not app.tiene_lineas(page)
+    page.draw_line((72, 100), (300, 100))
+    assert app.tiene_lineas(page)
+
+def test_extraer_todas_tablas_camelot_sin_paginas(monkeypatch):
+    def fake_read_pdf(*args, **kwargs):
+        raise AssertionError("Camelot no debe invocarse sin páginas con líneas")
+    monkeypatch.setattr(app.camelot, "read_pdf", fake_read_pdf)
+    assert app.extraer_todas_tablas_camelot("documento.pdf", []) == {}
+
+# Pruebas para pagina_binarizada y preprocesar_para_ocr
+
+def test_pagina_binarizada():
+    doc = fitz.open()
+    page = doc.new_page(width=72, height=144)
+    page.draw_line((10, 70), (60, 70), color=(0, 0, 0), width=2)
+    binaria = app.pagina_binarizada(page, dpi=72)
+    assert binaria.dtype == np.uint8
+    assert binaria.shape == (144, 72)
+    assert set(np.unique(binaria)) <= {0, 255}
+    assert binaria[70, 35] == 0
+    assert binaria[10, 35] == 255
+
+def test_preprocesar_para_ocr():
+    # Fondo con degradado de iluminación y un trazo oscuro en el centro
+    gris = np.tile(np.linspace(120, 250, 200, dtype=np.uint8), (100, 1))
+    gris[45:55, 50:150] = 20
+    binaria = app.preprocesar_para_ocr(gris)
+    assert binaria.shape == gris.shape
+    assert set(np.unique(binaria)) <= {0, 255}
+    assert (binaria[48:52, 60:140] == 0).all()
+    assert (binaria[:20] == 255).all()
+
+# Prueba para bounding_boxes_a_tabla simulando la salida de Tesseract
+
+def test_bounding_boxes_a_tabla(monkeypatch):
+    datos = {
+        "top": [0, 10, 12, 50, 51],
+        "left": [0, 200, 0, 0, 40],
+        "width": [0, 30, 30, 30, 30],
+        "conf": [-1, 90, 90, 90, 90],
+        "text": ["", "b", "a", "c", "d"],
+    }
+    monkeypatch.setattr(app.pytesseract, "image_to_data", lambda *args, **kwargs: datos)
+    tabla = app.bounding_boxes_a_tabla(None)
+    lineas = [l for l in tabla.split("\n") if l.startswith("|")]
+    assert "Col1" in lineas[0] and "Col2" in lineas[0]
+    assert "a" in lineas[1] and "b" in lineas[1]
+    assert "c d" in lineas[2]
+
 # Prueba para guardar_tablas_separadas
 
 def test_guardar_tablas_separadas(tmp_path):
-    tablas = ["+---+\n| a |\n+---+"]
+    tablas = [[["a"]]]
     carpeta_salida = tmp_path / "salida"
     carpeta_salida.mkdir()
     resultado = app.guardar_tablas_separadas(tablas, str(carpeta_salida), "1")
@@ -58,14 +159,155 @@ def test_guardar_tablas_separadas(tmp_path):
          data = json.load(f)
     assert isinstance(data, list)
     assert data[0]["tabla_num"] == 1
-    assert isinstance(data[0]["contenido"], list)
+    assert data[0]["contenido"] == [["a"]]
+
+def test_guardar_tablas_separadas_celda_con_barra(tmp_path):
+    # Un "|" dentro de una celda no debe partirla en columnas adicionales
+    page = fitz.open().new_page()
+    page.draw_rect(fitz.Rect(72, 100, 300, 200))
+    page.draw_line((72, 150), (300, 150))
+    page.draw_line((186, 100), (186, 200))
+    for punto, texto in [((80, 130), "a|x"), ((200, 130), "b"), ((80, 180), "c"), ((200, 180), "d")]:
+        page.insert_text(punto, texto)
+    (_, filas), = app.extraer_tablas_pymupdf(page)
+    resultado = app.guardar_tablas_separadas([filas], str(tmp_path), "1")
+    with open(resultado, "r", encoding="utf-8") as f:
+        assert json.load(f)[0]["contenido"] == [["a|x", "b"], ["c", "d"]]
+
+def test_escribir_json_sin_orjson(tmp_path, monkeypatch):
+    data = {"titulo": "Índice", "paginas": [1, 2], "ocr": False}
+    con_orjson = tmp_path / "con.json"
+    app.escribir_json(str(con_orjson), data)
+    monkeypatch.setattr(app, "orjson", None)
+    sin_orjson = tmp_path / "sin.json"
+    app.escribir_json(str(sin_orjson), data)
+    assert sin_orjson.read_bytes() == con_orjson.read_bytes()
+
+def test_escribir_atomico_fallido(tmp_path):
+    ruta = tmp_path / "resultado.json"
+    ruta.write_bytes(b"anterior")
+    # Escribir texto en un archivo binario falla a mitad de la escritura
+    with pytest.raises(TypeError):
+        app.escribir_atomico(str(ruta), "no son bytes")
+    assert ruta.read_bytes() == b"anterior"
+    assert list(tmp_path.iterdir()) == [ruta]
+
+def test_guardar_tablas_separadas_formato_invalido(tmp_path):
+    with pytest.raises(ValueError):
+        app.guardar_tablas_separadas([[["a"]]], str(tmp_path), "1", formato="xml")
+
+def test_guardar_tablas_separadas_msgpack(tmp_path):
+    msgpack = pytest.importorskip("msgpack")
+    resultado = app.guardar_tablas_separadas([[["a"]]], str(tmp_path), "1", formato="msgpack")
+    assert resultado.endswith("tablas_pag_1.msgpack")
+    with open(resultado, "rb") as f:
+        assert msgpack.unpackb(f.read()) == [{"tabla_num": 1, "contenido": [["a"]]}]
+
+def test_guardar_tablas_separadas_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    resultado = app.guardar_tablas_separadas([[["a"]]], str(tmp_path), "1", formato="parquet")
+    assert pq.read_table(resultado).to_pylist() == [{"tabla_num": 1, "contenido": [["a"]]}]
+
+# Pruebas para extraer_formularios
+
+def test_extraer_formularios_sin_formulario():
+    doc = fitz.open()
+    doc.new_page()
+    assert app.extraer_formularios(doc) == []
+
+def test_extraer_formularios_con_campo():
+    doc = fitz.open()
+    page = doc.new_page()
+    widget = fitz.Widget()
+    widget.field_name = "nombre"
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.field_value = "MOP"
+    widget.rect = fitz.Rect(50, 50, 200, 80)
+    page.add_widget(widget)
+    formularios = app.extraer_formularios(doc)
+    assert formularios == [{"pagina": 1, "campo_name": "nombre", "campo_value": "MOP"}]
 
 # Prueba para crear y buscar en el índice de búsqueda
 
-def test_crear_y_buscar_indice(tmp_path):
+def test_crear_y_buscar_indice(whoosh_index):
+    results = app.buscar_en_indice(whoosh_index, "prueba")
+    assert isinstance(results, list)
+    assert len(results) > 0
+
+def test_buscar_en_indice_sin_resultados(whoosh_index):
+    assert app.buscar_en_indice(whoosh_index, "hormigón") == []
+
+def test_crear_y_buscar_indice_por_pagina(tmp_path):
     carpeta_indice = str(tmp_path / "indice")
-    texto = "Este es un documento de prueba. Contiene información sobre OCR."
-    app.crear_indice_y_indexar(carpeta_indice, texto)
+    paginas = ["Primera página del informe.", "Segunda página con la prueba de OCR."]
+    app.crear_indice_y_indexar(carpeta_indice, paginas)
     results = app.buscar_en_indice(carpeta_indice, "prueba")
-    assert isinstance(results, list)
-    assert len(results) > 0
\ No newline at end of file
+    assert [r["pagina"] for r in results] == [2]
+
+def test_buscar_en_indice_reconstruido(tmp_path):
+    carpeta_indice = str(tmp_path / "indice")
+    app.crear_indice_y_indexar(carpeta_indice, ["Informe de puentes."])
+    assert len(app.buscar_en_indice(carpeta_indice, "puentes")) == 1
+    # El buscador en caché no debe devolver resultados del índice anterior
+    app.crear_indice_y_indexar(carpeta_indice, ["Informe de caminos."])
+    assert app.buscar_en_indice(carpeta_indice, "puentes") == []
+    assert len(app.buscar_en_indice(carpeta_indice, "caminos")) == 1
+
+def test_buscar_en_indice_cache(tmp_path):
+    carpeta_indice = str(tmp_path / "indice")
+    app.crear_indice_y_indexar(carpeta_indice, ["Informe de puentes."])
+    primera = app.buscar_en_indice(carpeta_indice, "puentes")
+    # Modificar el resultado devuelto no debe alterar la caché
+    primera[0]["pagina"] = 99
+    assert app.buscar_en_indice(carpeta_indice, "puentes") == [{"id": "pagina_1", "pagina": 1}]
+    assert app._buscar_cacheado.cache_info().hits >= 1
+
+def test_buscar_en_indice_reconstruido_por_otro_proceso(tmp_path):
+    carpeta_indice = str(tmp_path / "indice")
+    app.crear_indice_y_indexar(carpeta_indice, ["Informe de puentes."])
+    assert len(app.buscar_en_indice(carpeta_indice, "puentes")) == 1
+    # Reconstrucción directa con Whoosh, sin pasar por crear_indice_y_indexar ni vaciar la caché
+    ix = app.index.create_in(carpeta_indice, app._ESQUEMA_INDICE)
+    with ix.writer() as writer:
+        writer.add_document(id="pagina_1", pagina=1, content="Informe de caminos.")
+    assert app.buscar_en_indice(carpeta_indice, "puentes") == []
+    assert len(app.buscar_en_indice(carpeta_indice, "caminos")) == 1
+
+def test_buscar_en_indice_con_esquema_anterior(tmp_path):
+    # Índice creado con otro analizador (sin pasar a minúsculas): las consultas
+    # deben analizarse con el esquema guardado en el índice, no con el actual
+    carpeta_indice = tmp_path / "indice"
+    carpeta_indice.mkdir()
+    esquema = Schema(id=ID(stored=True), pagina=NUMERIC(stored=True),
+                     content=TEXT(analyzer=RegexTokenizer()))
+    ix = app.index.create_in(str(carpeta_indice), esquema)
+    with ix.writer() as writer:
+        writer.add_document(id="pagina_1", pagina=1, content="Informe de Puentes.")
+    assert [r["pagina"] for r in app.buscar_en_indice(str(carpeta_indice), "Puentes")] == [1]
+
+def test_crear_indice_multiproceso(tmp_path):
+    carpeta_indice = str(tmp_path / "indice")
+    paginas = [f"Página {n} del informe." for n in range(1, 20)] + ["Anexo con la prueba de OCR."]
+    app.crear_indice_y_indexar(carpeta_indice, paginas, procs=2)
+    results = app.buscar_en_indice(carpeta_indice, "prueba")
+    assert [r["pagina"] for r in results] == [20]
+
+# Prueba para generar_resultados: empaqueta los resultados en un ZIP sin usar el binario zip
+
+def test_generar_resultados_zip(tmp_path, monkeypatch):
+    carpeta_salida = tmp_path / "resultado"
+    carpeta_salida.mkdir()
+    pdf_path = tmp_path / "temp.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fake")
+    def fake_procesar_pdf(pdf, carpeta):
+        json_path = carpeta_salida / "resultado.json"
+        txt_path = carpeta_salida / "resultado.txt"
+        json_path.write_text("{}", encoding="utf-8")
+        txt_path.write_text("texto", encoding="utf-8")
+        return str(json_path), str(txt_path)
+    monkeypatch.setattr(app, "procesar_pdf", fake_procesar_pdf)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    app.generar_resultados(str(pdf_path), str(carpeta_salida))
+    with zipfile.ZipFile(tmp_path / "Downloads" / "resultado.zip") as z:
+        assert sorted(z.namelist()) == ["original.pdf", "resultado.json", "resultado.txt"]
@@ -1,6 +1,109 @@
+import os
+import subprocess
+import sys
+
+import fitz
 import pytest
 import app
 
 def test_procesar_pdf_inexistente():
     with pytest.raises(FileNotFoundError):
         app.procesar_pdf("archivo_inexistente.pdf", "salida_test")
+
+def test_procesar_pdf_formato_tablas_invalido(tmp_path, monkeypatch):
+    def fake_ocr(*args, **kwargs):
+        raise AssertionError("No debe aplicarse OCR con un formato inválido")
+    monkeypatch.setattr(app, "ocr_paginas_en_paralelo", fake_ocr)
+    pdf_path = str(tmp_path / "documento.pdf")
+    doc = fitz.open()
+    doc.new_page()
+    doc.save(pdf_path)
+    with pytest.raises(ValueError):
+        app.procesar_pdf(pdf_path, str(tmp_path / "salida"), formato_tablas="xml")
+
+def test_ocr_pagina_con_tesserocr(tmp_path, monkeypatch):
+    pdf_path = str(tmp_path / "escaneado.pdf")
+    doc = fitz.open()
+    doc.new_page(width=72, height=72)
+    doc.save(pdf_path)
+
+    class FakeAPI:
+        def __init__(self, lang, psm, oem, variables):
+            self.lang, self.variables = lang, variables
+        def SetImage(self, img):
+            self.img = img
+        def GetUTF8Text(self):
+            return f"{self.lang} {self.img.mode}"
+
+    class FakeTesserocr:
+        PSM = type("PSM", (), {"SINGLE_BLOCK": 6})
+        OEM = type("OEM", (), {"LSTM_ONLY": 1})
+        PyTessBaseAPI = FakeAPI
+
+    monkeypatch.setattr(app, "tesserocr", FakeTesserocr)
+    # El estado del worker vuelve a None al terminar la prueba
+    for nombre in ("_doc_ocr", "_idioma_ocr", "_api_ocr"):
+        monkeypatch.setattr(app, nombre, None)
+    app._inicializar_worker_ocr(pdf_path, "spa")
+    try:
+        assert app._api_ocr.variables == app.VARIABLES_TESSERACT
+        assert app._ocr_pagina(1) == (1, "spa L")
+    finally:
+        app._doc_ocr.close()
+
+def test_omp_thread_limit_antes_de_tesserocr(tmp_path):
+    # Un tesserocr falso registra el valor de OMP_THREAD_LIMIT en el momento de importarse
+    (tmp_path / "tesserocr.py").write_text(
+        'import os\nOMP_AL_IMPORTAR = os.environ.get("OMP_THREAD_LIMIT")\n', encoding="utf-8")
+    env = {k: v for k, v in os.environ.items() if k != "OMP_THREAD_LIMIT"}
+    env["PYTHONPATH"] = os.pathsep.join([str(tmp_path), os.path.dirname(app.__file__)])
+    salida = subprocess.run([sys.executable, "-c", "import app; print(app.tesserocr.OMP_AL_IMPORTAR)"],
+                            env=env, capture_output=True, text=True, check=True)
+    assert salida.stdout.strip().splitlines()[-1] == "1"
+
+def test_ocr_paginas_en_paralelo_usa_cache(tmp_path, monkeypatch):
+    pdf_path = str(tmp_path / "escaneado.pdf")
+    doc = fitz.open()
+    doc.new_page(width=72, height=72)
+    doc.new_page(width=72, height=72)
+    doc.save(pdf_path)
+    monkeypatch.setattr(app, "CARPETA_CACHE_OCR", str(tmp_path / "cache"))
+    monkeypatch.setattr(app, "tesserocr", None)
+    monkeypatch.setattr(app.pytesseract, "image_to_string",
+                        lambda img, lang=None, config="": f"texto {lang}")
+    llamadas = []
+    resultado = app.ocr_paginas_en_paralelo(pdf_path, [1, 2], mientras_tanto=lambda: llamadas.append(1))
+    assert resultado == {1: "texto spa", 2: "texto spa"}
+    assert llamadas == [1]
+
+    # Con ambas páginas en caché no se lanza el pool de procesos
+    class SinPool:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("No debe aplicarse OCR a páginas en caché")
+    monkeypatch.setattr(app, "ProcessPoolExecutor", SinPool)
+    assert app.ocr_paginas_en_paralelo(pdf_path, [1, 2]) == {1: "texto spa", 2: "texto spa"}
+
+
+def test_carpeta_cache_ocr_depende_de_motor_y_preprocesado(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "documento.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fake")
+    monkeypatch.setattr(app, "_version_motor_ocr", lambda idioma: "tesseract 5.3.0|spa:1:1")
+    carpeta = app._carpeta_cache_ocr(str(pdf_path), "spa")
+    monkeypatch.setattr(app, "_version_motor_ocr", lambda idioma: "tesseract 5.4.1|spa:1:1")
+    otro_motor = app._carpeta_cache_ocr(str(pdf_path), "spa")
+    monkeypatch.setattr(app, "VERSION_PREPROCESADO", app.VERSION_PREPROCESADO + 1)
+    otro_preprocesado = app._carpeta_cache_ocr(str(pdf_path), "spa")
+    assert len({carpeta, otro_motor, otro_preprocesado}) == 3
+    # La huella del PDF es la misma: solo cambia la subcarpeta de ajustes
+    assert len({os.path.dirname(c) for c in (carpeta, otro_motor, otro_preprocesado)}) == 1
+
+def test_recortar_cache_ocr(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "CARPETA_CACHE_OCR", str(tmp_path))
+    monkeypatch.setattr(app, "TAMANO_MAXIMO_CACHE_OCR", 250)
+    for n, nombre in enumerate(["antiguo", "intermedio", "actual"]):
+        carpeta = tmp_path / nombre / "ajustes"
+        carpeta.mkdir(parents=True)
+        (carpeta / "pagina_1.txt").write_bytes(b"x" * 100)
+        os.utime(tmp_path / nombre, (n, n))
+    app._recortar_cache_ocr(str(tmp_path / "actual"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["actual", "intermedio"]